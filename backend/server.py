@@ -1,18 +1,26 @@
 from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DocumentTooLarge, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+import sys
 import uuid
+import hashlib
+from bisect import bisect_right
+from collections import OrderedDict
+import re
 from datetime import datetime
-import PyPDF2
+import pypdfium2 as pdfium
 import asyncio
-import aiofiles
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import openpyxl
 import xlrd
 from docx import Document
@@ -27,8 +35,11 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Process pool for CPU-bound document parsing, keeps the event loop free
+EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count())
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -39,16 +50,33 @@ DOCUMENT_BASE_PATH = Path("/var/www/html/pdf")
 # Supported file extensions
 SUPPORTED_EXTENSIONS = {'.pdf', '.xlsx', '.xls', '.docx', '.doc', '.rtf', '.txt'}
 
-# Models
-class FileItem(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    path: str
-    type: str  # 'file' or 'folder'
-    size: Optional[int] = None
-    modified: Optional[datetime] = None
-    parent_path: str
+# In-memory document list used by filename search, refreshed when any directory in the tree changes
+_file_cache = {"dir_mtimes": None, "entries": [], "names": "", "name_starts": []}
+# Separates names in the joined lowercase name string, cannot occur in file names
+NAME_SEPARATOR = "\0"
+
+# LRU cache of extracted text keyed by (path, mtime, size)
+EXTRACT_CACHE_MAX_ENTRIES = 1000
+# Measured with sys.getsizeof, a str takes 1 to 4 bytes per character
+EXTRACT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+_extract_cache = OrderedDict()
+_extract_cache_bytes = 0
 
+# Indexing tuning
+INDEX_CONCURRENCY = 16
+INDEX_BATCH_SIZE = 100
+# Bump when the stored document format changes to force a full re-index
+INDEX_VERSION = 2
+QUICK_HASH_BYTES = 65536
+# Upper bound on the stored phraselist, keeps large documents under the 16 MB BSON limit
+PHRASELIST_MAX_BYTES = 1024 * 1024
+# Larger texts are stored without content_lower, tokens and phraselist, which would each roughly double the document
+LARGE_TEXT_BYTES = 4 * 1024 * 1024
+
+# Deepest folder level expanded by the recursive file tree
+TREE_MAX_DEPTH = 32
+
+# Models
 class SearchResult(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     file_path: str
@@ -61,92 +89,337 @@ class IndexedFile(BaseModel):
     file_path: str
     file_name: str
     content: str
+    content_lower: str = ""
+    tokens: List[str] = Field(default_factory=list)
+    phraselist: List[str] = Field(default_factory=list)
+    mtime: Optional[float] = None
+    quick_hash: Optional[str] = None
+    index_version: int = INDEX_VERSION
     indexed_at: datetime = Field(default_factory=lambda: datetime.now())
 
 # Utility functions
-def get_file_info(file_path: Path) -> Dict[str, Any]:
-    """Get file information"""
+def get_file_info(entry: os.DirEntry) -> Dict[str, Any]:
+    """Get file information from a directory entry"""
     try:
-        stat = file_path.stat()
+        # DirEntry caches the file type from the directory read
+        is_dir = entry.is_dir()
+        stat = entry.stat()
         return {
-            "name": file_path.name,
-            "path": str(file_path),
-            "type": "folder" if file_path.is_dir() else "file",
-            "size": stat.st_size if file_path.is_file() else None,
-            "modified": datetime.fromtimestamp(stat.st_mtime),
-            "parent_path": str(file_path.parent)
+            "name": entry.name,
+            "path": entry.path,
+            "type": "folder" if is_dir else "file",
+            "size": stat.st_size if entry.is_file() else None,
+            "modified": stat.st_mtime,  # epoch seconds
+            "parent_path": os.path.dirname(entry.path)
         }
     except Exception as e:
-        logger.error(f"Error getting file info for {file_path}: {e}")
+        logger.error(f"Error getting file info for {entry.path}: {e}")
         return None
 
-async def extract_pdf_text(file_path: Path) -> str:
-    """Extract text content from PDF"""
+def walk_document_tree() -> Tuple[List[Path], Dict[str, float]]:
+    """Walk the document tree once, collecting supported document files and the mtime of every directory"""
+    doc_paths = []
+    dir_mtimes = {}
+    pending = [str(DOCUMENT_BASE_PATH)]
+    while pending:
+        root = pending.pop()
+        try:
+            # Stat before listing so changes made during the walk are seen next time
+            dir_mtimes[root] = os.stat(root).st_mtime
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                # Like os.walk, do not descend into symlinked directories
+                if not entry.is_symlink():
+                    pending.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                doc_paths.append(Path(entry.path))
+    return doc_paths, dir_mtimes
+
+def walk_documents() -> List[Path]:
+    """Walk the document tree once and collect all supported document files"""
+    return walk_document_tree()[0]
+
+def get_directory_mtimes(dir_paths) -> Optional[Dict[str, float]]:
+    """Stat the given directories, None when one of them is gone"""
     try:
-        text = ""
-        async with aiofiles.open(file_path, 'rb') as file:
-            content = await file.read()
-            
-        # Use PyPDF2 to extract text
-        import io
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+        return {dir_path: os.stat(dir_path).st_mtime for dir_path in dir_paths}
+    except OSError:
+        return None
+
+def refresh_file_cache(doc_paths: List[Path], dir_mtimes: Dict[str, float]):
+    """Store the document list along with all lowercased names joined into one string"""
+    entries = [(str(doc_path.relative_to(DOCUMENT_BASE_PATH)), doc_path.name) for doc_path in doc_paths]
+    names_lower = [name.lower() for _, name in entries]
+    name_starts = []
+    offset = 0
+    for name_lower in names_lower:
+        name_starts.append(offset)
+        offset += len(name_lower) + len(NAME_SEPARATOR)
+    _file_cache["entries"] = entries
+    _file_cache["names"] = NAME_SEPARATOR.join(names_lower)
+    _file_cache["name_starts"] = name_starts
+    _file_cache["dir_mtimes"] = dir_mtimes
+
+async def find_documents_by_name(search_term: str) -> List[tuple]:
+    """Get (relative path, name) of all documents whose name contains search_term.
+
+    All names are scanned in a single pass over the joined name string. The
+    tree is only re-walked when the mtime of any directory in it changes or
+    after a re-index. Checking that costs one stat per directory, no listing.
+    """
+    cached_mtimes = _file_cache["dir_mtimes"]
+    dir_mtimes = await asyncio.to_thread(get_directory_mtimes, cached_mtimes) if cached_mtimes else None
+    if dir_mtimes is None or dir_mtimes != cached_mtimes:
+        doc_paths, dir_mtimes = await asyncio.to_thread(walk_document_tree)
+        refresh_file_cache(doc_paths, dir_mtimes)
+    
+    if NAME_SEPARATOR in search_term:
+        return []
+    entries = _file_cache["entries"]
+    names = _file_cache["names"]
+    name_starts = _file_cache["name_starts"]
+    matches = []
+    match_index = names.find(search_term)
+    while match_index >= 0:
+        entry_index = bisect_right(name_starts, match_index) - 1
+        matches.append(entries[entry_index])
+        # Continue from the next name so each document matches at most once
+        if entry_index + 1 == len(name_starts):
+            break
+        match_index = names.find(search_term, name_starts[entry_index + 1])
+    return matches
+
+def compute_quick_hash(file_path: Path) -> str:
+    """Hash the first QUICK_HASH_BYTES of a file to detect content changes"""
+    with open(file_path, 'rb') as file:
+        return hashlib.blake2b(file.read(QUICK_HASH_BYTES), digest_size=16).hexdigest()
+
+def build_phraselist(content_lower: str, min_words: int = 2, max_words: int = 6) -> List[str]:
+    """Build n-word shingles of lowercased content used for exact phrase lookups.
+
+    Shorter phrases are added first and the list stops growing at
+    PHRASELIST_MAX_BYTES. Phrases left out are still found by the regex fallback.
+    """
+    words = content_lower.split()
+    phrases = set()
+    total_bytes = 0
+    for size in range(min_words, max_words + 1):
+        for start in range(len(words) - size + 1):
+            phrase = " ".join(words[start:start + size])
+            if phrase in phrases:
+                continue
+            total_bytes += len(phrase.encode()) + 1
+            if total_bytes > PHRASELIST_MAX_BYTES:
+                return list(phrases)
+            phrases.add(phrase)
+    return list(phrases)
+
+def build_tokens(content_lower: str) -> List[str]:
+    """Get the distinct words of lowercased content"""
+    return sorted(set(re.findall(r"\w+", content_lower)))
+
+def extract_trigrams(text: str) -> set:
+    """Split lowercased text into its set of 3-character grams"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+async def index_trigrams(file_path: str, content_lower: str):
+    """Add file_path to the trigram posting list of every gram in content_lower"""
+    operations = [
+        UpdateOne({"gram": gram}, {"$addToSet": {"files": file_path}}, upsert=True)
+        for gram in extract_trigrams(content_lower)
+    ]
+    if operations:
+        await db.trigrams.bulk_write(operations, ordered=False)
+
+async def find_trigram_candidates(search_term: str) -> Optional[List[str]]:
+    """Intersect trigram posting lists to get files that may contain search_term.
+
+    Returns None when the term is too short to prefilter.
+    """
+    grams = extract_trigrams(search_term)
+    if not grams:
+        return None
+    
+    candidates = None
+    postings = await db.trigrams.find({"gram": {"$in": list(grams)}}).to_list(None)
+    if len(postings) < len(grams):
+        # At least one gram never occurs in any indexed file
+        return []
+    for posting in postings:
+        files = set(posting["files"])
+        candidates = files if candidates is None else candidates & files
+        if not candidates:
+            return []
+    return list(candidates)
+
+def build_snippet(content: str, content_lower: str, search_term: str, radius: int = 100) -> str:
+    """Extract a snippet of content around the first match of search_term.
+
+    The match is located in the stored lowercased content and the snippet is
+    sliced from the original content for display. Large texts are stored
+    without content_lower and are searched case-insensitively instead.
+    """
+    if content_lower:
+        match_index = content_lower.find(search_term)
+    else:
+        match = re.search(re.escape(search_term), content, re.IGNORECASE)
+        match_index = match.start() if match else -1
+    if match_index < 0:
+        # Text index matches are stemmed and may not contain the literal term
+        match_index = 0
+    start = max(0, match_index - radius)
+    end = min(len(content), match_index + radius)
+    return content[start:end]
+
+async def ensure_search_indexes():
+    """Create the indexes backing content search"""
+    await db.indexed_files.create_index([("content", "text"), ("file_name", "text")])
+    await db.indexed_files.create_index([("file_path", 1)], unique=True)
+    await db.indexed_files.create_index([("phraselist", 1)])
+    await db.indexed_files.create_index([("tokens", 1)])
+
+async def find_content_matches(search_term: str, limit: int) -> List[Dict[str, Any]]:
+    """Find indexed files whose content matches search_term.
+
+    Uses the text index first, then exact phrase and word lookups, and only falls back
+    to a regex scan when the index-backed queries return fewer than limit results.
+    The regex scan is restricted to the files surviving the trigram prefilter.
+    """
+    projection = {"content": 1, "content_lower": 1, "file_path": 1, "file_name": 1}
+    # Quoted so the whole term is required, unquoted $text is a stemmed OR of its words
+    phrase = search_term.replace('"', '').strip()
+    matches = []
+    if phrase:
+        try:
+            matches = await db.indexed_files.find(
+                {"$text": {"$search": f'"{phrase}"'}, "content": {"$ne": ""}},
+                {**projection, "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).to_list(limit)
+        except OperationFailure as e:
+            # No text index yet, the phrase and regex lookups still apply
+            logger.warning(f"Text search unavailable: {e}")
+    seen = {match["file_path"] for match in matches}
+
+    if len(matches) < limit:
+        phrase_matches = await db.indexed_files.find(
+            {
+                "$or": [{"phraselist": search_term}, {"tokens": search_term}],
+                "file_path": {"$nin": list(seen)}
+            },
+            projection
+        ).to_list(limit - len(matches))
+        matches.extend(phrase_matches)
+        seen.update(match["file_path"] for match in phrase_matches)
+
+    if len(matches) < limit:
+        candidates = await find_trigram_candidates(search_term)
+        if candidates is None:
+            path_filter = {"$nin": list(seen)}
+        else:
+            path_filter = {"$in": [path for path in candidates if path not in seen]}
         
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        if candidates is None or path_filter["$in"]:
+            pattern = re.escape(search_term)
+            regex_matches = await db.indexed_files.find(
+                {
+                    "$or": [
+                        {"content_lower": {"$regex": pattern}},
+                        # Large texts are stored without a lowercased copy
+                        {"content_lower": "", "content": {"$regex": pattern, "$options": "i"}}
+                    ],
+                    "file_path": path_filter
+                },
+                projection
+            ).to_list(limit - len(matches))
+            matches.extend(regex_matches)
+
+    return matches
+
+def _extract_pdf_page_text(page) -> str:
+    """Extract text from a single PDF page, releasing it straight away"""
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        # Keep only one decoded page alive instead of the whole document
+        textpage.close()
+        page.close()
+
+def _extract_pdf_sync(file_path: str) -> Optional[str]:
+    """Extract text content from PDF"""
+    try:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            text = "\n".join(_extract_pdf_page_text(page) for page in pdf)
+        finally:
+            pdf.close()
             
         return text.strip()
     except Exception as e:
         logger.error(f"Error extracting text from PDF {file_path}: {e}")
-        return ""
+        return None
 
-async def extract_excel_text(file_path: Path) -> str:
+def _extract_excel_sync(file_path: str) -> Optional[str]:
     """Extract text content from Excel files"""
     try:
-        text = ""
-        if file_path.suffix.lower() == '.xlsx':
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                    if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
-        elif file_path.suffix.lower() == '.xls':
-            workbook = xlrd.open_workbook(file_path)
-            for sheet_idx in range(workbook.nsheets):
-                sheet = workbook.sheet_by_index(sheet_idx)
-                text += f"Sheet: {sheet.name}\n"
-                for row_idx in range(sheet.nrows):
-                    row_text = " | ".join([str(sheet.cell_value(row_idx, col_idx)) for col_idx in range(sheet.ncols)])
-                    if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
-        return text.strip()
+        lines = []
+        extension = Path(file_path).suffix.lower()
+        if extension == '.xlsx':
+            # Read-only mode streams rows instead of building the whole workbook
+            wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
+            try:
+                for sheet_name in wb.sheetnames:
+                    sheet = wb[sheet_name]
+                    lines.append(f"Sheet: {sheet_name}")
+                    for row in sheet.iter_rows(values_only=True):
+                        row_text = " | ".join(str(cell) if cell is not None else "" for cell in row)
+                        if row_text.strip():
+                            lines.append(row_text)
+                    lines.append("")
+            finally:
+                wb.close()
+        elif extension == '.xls':
+            # Load sheets lazily and drop each one once processed
+            workbook = xlrd.open_workbook(file_path, on_demand=True)
+            try:
+                for sheet_idx in range(workbook.nsheets):
+                    sheet = workbook.sheet_by_index(sheet_idx)
+                    lines.append(f"Sheet: {sheet.name}")
+                    for row_idx in range(sheet.nrows):
+                        row_text = " | ".join(str(sheet.cell_value(row_idx, col_idx)) for col_idx in range(sheet.ncols))
+                        if row_text.strip():
+                            lines.append(row_text)
+                    lines.append("")
+                    workbook.unload_sheet(sheet_idx)
+            finally:
+                workbook.release_resources()
+        return "\n".join(lines).strip()
     except Exception as e:
         logger.error(f"Error extracting text from Excel {file_path}: {e}")
-        return ""
+        return None
 
-async def extract_word_text(file_path: Path) -> str:
+def _extract_word_sync(file_path: str) -> Optional[str]:
     """Extract text content from Word documents"""
     try:
-        if file_path.suffix.lower() == '.docx':
+        extension = Path(file_path).suffix.lower()
+        if extension == '.docx':
             doc = Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+            text = "\n".join(paragraph.text for paragraph in doc.paragraphs)
             return text.strip()
-        elif file_path.suffix.lower() == '.doc':
+        elif extension == '.doc':
             # Use docx2txt for .doc files
-            text = docx2txt.process(str(file_path))
+            text = docx2txt.process(file_path)
             return text.strip() if text else ""
         return ""
     except Exception as e:
         logger.error(f"Error extracting text from Word document {file_path}: {e}")
-        return ""
+        return None
 
-async def extract_rtf_text(file_path: Path) -> str:
+def _extract_rtf_sync(file_path: str) -> Optional[str]:
     """Extract text content from RTF files"""
     try:
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
@@ -155,20 +428,89 @@ async def extract_rtf_text(file_path: Path) -> str:
         return text.strip()
     except Exception as e:
         logger.error(f"Error extracting text from RTF {file_path}: {e}")
-        return ""
+        return None
+
+def replace_broken_executor(executor: ProcessPoolExecutor):
+    """Swap in a fresh process pool, once per broken pool"""
+    global EXECUTOR
+    if EXECUTOR is executor:
+        EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count())
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_executor(func, file_path: Path) -> Optional[str]:
+    """Run a CPU-bound extractor in the process pool.
 
-async def extract_text_file(file_path: Path) -> str:
+    A worker dying (native crash, OOM kill) breaks the whole pool, so it is
+    replaced and the extraction retried once. A second failure is raised
+    rather than returned as "" so the file is not stored as empty.
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = EXECUTOR
+        try:
+            return await loop.run_in_executor(executor, func, str(file_path))
+        except BrokenProcessPool:
+            logger.error(f"Process pool broken while extracting {file_path}")
+            replace_broken_executor(executor)
+            if attempt:
+                raise
+
+async def extract_pdf_text(file_path: Path) -> Optional[str]:
+    """Extract text content from PDF"""
+    return await run_in_executor(_extract_pdf_sync, file_path)
+
+async def extract_excel_text(file_path: Path) -> Optional[str]:
+    """Extract text content from Excel files"""
+    return await run_in_executor(_extract_excel_sync, file_path)
+
+async def extract_word_text(file_path: Path) -> Optional[str]:
+    """Extract text content from Word documents"""
+    return await run_in_executor(_extract_word_sync, file_path)
+
+async def extract_rtf_text(file_path: Path) -> Optional[str]:
+    """Extract text content from RTF files"""
+    return await run_in_executor(_extract_rtf_sync, file_path)
+
+async def extract_text_file(file_path: Path) -> Optional[str]:
     """Extract text content from plain text files"""
     try:
-        async with aiofiles.open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-            content = await file.read()
+        content = await asyncio.to_thread(file_path.read_text, encoding='utf-8', errors='ignore')
         return content.strip()
     except Exception as e:
         logger.error(f"Error reading text file {file_path}: {e}")
-        return ""
+        return None
+
+async def extract_document_text(file_path: Path) -> Optional[str]:
+    """Extract text from any supported document format, reusing cached text for unchanged files.
 
-async def extract_document_text(file_path: Path) -> str:
-    """Extract text from any supported document format"""
+    Returns None when extraction failed, as opposed to "" for a document without text.
+    """
+    stat = file_path.stat()
+    cache_key = (str(file_path), stat.st_mtime, stat.st_size)
+    if cache_key in _extract_cache:
+        _extract_cache.move_to_end(cache_key)
+        return _extract_cache[cache_key]
+    
+    text = await extract_by_format(file_path)
+    # Only cache real text, a failure fixed without touching the file (e.g. chmod) keeps the same key
+    if text:
+        cache_extracted_text(cache_key, text)
+    return text
+
+def cache_extracted_text(cache_key: tuple, text: str):
+    """Store extracted text, evicting least recently used entries over the limits"""
+    global _extract_cache_bytes
+    text_bytes = sys.getsizeof(text)
+    if text_bytes > EXTRACT_CACHE_MAX_BYTES:
+        return
+    _extract_cache[cache_key] = text
+    _extract_cache_bytes += text_bytes
+    while len(_extract_cache) > EXTRACT_CACHE_MAX_ENTRIES or _extract_cache_bytes > EXTRACT_CACHE_MAX_BYTES:
+        _, evicted = _extract_cache.popitem(last=False)
+        _extract_cache_bytes -= sys.getsizeof(evicted)
+
+async def extract_by_format(file_path: Path) -> Optional[str]:
+    """Dispatch text extraction on the document's file extension"""
     extension = file_path.suffix.lower()
     
     if extension == '.pdf':
@@ -190,32 +532,61 @@ async def extract_document_text(file_path: Path) -> str:
 async def root():
     return {"message": "PDF Search System API"}
 
+def list_directory(current_path: Path) -> List[Dict[str, Any]]:
+    """List the visible files and folders of a directory"""
+    items = []
+    
+    # For relative path calculation
+    parent_path = str(current_path.relative_to(DOCUMENT_BASE_PATH)) if current_path != DOCUMENT_BASE_PATH else ""
+    
+    with os.scandir(current_path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+            
+        file_info = get_file_info(entry)
+        if file_info:
+            file_info["path"] = os.path.join(parent_path, entry.name) if parent_path else entry.name
+            file_info["parent_path"] = parent_path
+            # The relative path is unique and stable, no need for a random id
+            file_info["id"] = file_info["path"]
+            
+            items.append(file_info)
+    
+    return items
+
+def build_tree(current_path: Path, depth: int = 0) -> Dict[str, Any]:
+    """List a directory along with all of its subfolders, keyed by folder name.
+
+    Symlinked folders are listed but not expanded, like in walk_document_tree,
+    so link loops cannot recurse forever. Expansion also stops at TREE_MAX_DEPTH.
+    """
+    items = list_directory(current_path)
+    children = {}
+    if depth < TREE_MAX_DEPTH:
+        for item in items:
+            child_path = current_path / item["name"]
+            if item["type"] == "folder" and not child_path.is_symlink():
+                children[item["name"]] = build_tree(child_path, depth + 1)
+    return {"items": items, "children": children}
+
 @api_router.get("/files/tree")
-async def get_file_tree(path: str = ""):
-    """Get folder structure and files"""
+async def get_file_tree(path: str = "", recursive: bool = False):
+    """Get folder structure and files, optionally for the whole subtree in one call"""
     try:
         current_path = DOCUMENT_BASE_PATH / path if path else DOCUMENT_BASE_PATH
         
         if not current_path.exists():
             raise HTTPException(status_code=404, detail="Path not found")
         
-        items = []
-        
         # Get all items in current directory
         try:
-            for item_path in sorted(current_path.iterdir()):
-                if item_path.name.startswith('.'):
-                    continue
-                    
-                file_info = get_file_info(item_path)
-                if file_info:
-                    # For relative path calculation
-                    relative_path = str(item_path.relative_to(DOCUMENT_BASE_PATH))
-                    file_info["path"] = relative_path
-                    file_info["parent_path"] = str(item_path.parent.relative_to(DOCUMENT_BASE_PATH)) if item_path.parent != DOCUMENT_BASE_PATH else ""
-                    
-                    items.append(FileItem(**file_info))
-                    
+            if recursive:
+                tree = await asyncio.to_thread(build_tree, current_path)
+                return {**tree, "current_path": path}
+            items = list_directory(current_path)
         except PermissionError:
             raise HTTPException(status_code=403, detail="Permission denied")
             
@@ -263,43 +634,150 @@ async def serve_document(file_path: str):
 
 @api_router.post("/files/index")
 async def index_documents():
-    """Index all supported document files for content search"""
+    """Index all supported document files for content search.
+
+    Files whose mtime and quick hash match their stored entry are skipped,
+    so re-indexing only re-extracts changed files.
+    """
     try:
         indexed_count = 0
+        skipped_count = 0
+        pending = []
+        seen = []
+        semaphore = asyncio.Semaphore(INDEX_CONCURRENCY)
         
-        # Clear existing index
-        await db.indexed_files.delete_many({})
+        # Trigram upserts look documents up by gram and stale postings are
+        # pulled by file, so index both before writing
+        await db.trigrams.create_index([("gram", 1)], unique=True)
+        await db.trigrams.create_index([("files", 1)])
         
-        # Walk through all supported document files
-        for extension in SUPPORTED_EXTENSIONS:
-            for doc_path in DOCUMENT_BASE_PATH.rglob(f"*{extension}"):
+        async def flush():
+            nonlocal indexed_count, pending
+            if not pending:
+                return
+            batch, pending = pending, []
+            operations = [operation for _, operation, _ in batch]
+            failed = set()
+            try:
+                await db.indexed_files.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            except DocumentTooLarge:
+                # Raised for the whole batch, write one by one to isolate the oversized files
+                for index, operation in enumerate(operations):
+                    try:
+                        await db.indexed_files.bulk_write([operation])
+                    except (BulkWriteError, DocumentTooLarge):
+                        failed.add(index)
+            
+            for index in sorted(failed):
+                logger.error(f"Error storing index entry for {batch[index][0]}")
+            indexed_count += sum(
+                has_content for index, (_, _, has_content) in enumerate(batch) if index not in failed
+            )
+        
+        async def process(doc_path: Path):
+            nonlocal skipped_count
+            async with semaphore:
                 try:
+                    relative_path = str(doc_path.relative_to(DOCUMENT_BASE_PATH))
+                    seen.append(relative_path)
+                    
+                    # Skip files unchanged since they were last indexed
+                    mtime = doc_path.stat().st_mtime
+                    quick_hash = await asyncio.to_thread(compute_quick_hash, doc_path)
+                    existing = await db.indexed_files.find_one({
+                        "file_path": relative_path,
+                        "mtime": mtime,
+                        "quick_hash": quick_hash,
+                        "index_version": INDEX_VERSION
+                    }, {"_id": 1})
+                    if existing:
+                        skipped_count += 1
+                        return
+                    
                     # Extract text content
                     content = await extract_document_text(doc_path)
+                    if content is None:
+                        # Extraction failed and was logged, keep any previous entry and retry next run
+                        return
                     
+                    await db.trigrams.update_many({"files": relative_path}, {"$pull": {"files": relative_path}})
+                    # Files without text, like scanned PDFs, are stored as empty stubs
+                    # so the unchanged check skips them on the next run
+                    indexed_file = IndexedFile(
+                        file_path=relative_path,
+                        file_name=doc_path.name,
+                        content=content,
+                        mtime=mtime,
+                        quick_hash=quick_hash
+                    )
                     if content:
-                        # Store in database
-                        indexed_file = IndexedFile(
-                            file_path=str(doc_path.relative_to(DOCUMENT_BASE_PATH)),
-                            file_name=doc_path.name,
-                            content=content
-                        )
-                        
-                        await db.indexed_files.insert_one(indexed_file.dict())
-                        indexed_count += 1
+                        content_lower = content.lower()
+                        # Keep large texts to a single copy to stay under the 16 MB document limit
+                        if len(content.encode()) <= LARGE_TEXT_BYTES:
+                            indexed_file.content_lower = content_lower
+                            indexed_file.tokens = build_tokens(content_lower)
+                            indexed_file.phraselist = build_phraselist(content_lower)
                         
+                        await index_trigrams(relative_path, content_lower)
                         logger.info(f"Indexed: {doc_path.name}")
+                    
+                    # Store in database in batches
+                    pending.append((relative_path, ReplaceOne({"file_path": relative_path}, indexed_file.dict(), upsert=True), bool(content)))
+                    
+                    if len(pending) >= INDEX_BATCH_SIZE:
+                        await flush()
                         
                 except Exception as e:
                     logger.error(f"Error indexing {doc_path}: {e}")
-                    continue
+        
+        # Walk the tree once for all supported document files
+        doc_paths, dir_mtimes = await asyncio.to_thread(walk_document_tree)
+        refresh_file_cache(doc_paths, dir_mtimes)
+        await asyncio.gather(*(process(doc_path) for doc_path in doc_paths))
+        await flush()
+        
+        # Remove files that no longer exist
+        removed = await db.indexed_files.distinct("file_path", {"file_path": {"$nin": seen}})
+        if removed:
+            await db.trigrams.update_many({"files": {"$in": removed}}, {"$pull": {"files": {"$in": removed}}})
+            await db.indexed_files.delete_many({"file_path": {"$in": removed}})
+        await db.trigrams.delete_many({"files": {"$size": 0}})
+        
+        # Build search indexes after the bulk insert rather than per document
+        await ensure_search_indexes()
                     
-        return {"message": f"Indexed {indexed_count} document files"}
+        return {"message": f"Indexed {indexed_count} document files ({skipped_count} unchanged)"}
         
     except Exception as e:
         logger.error(f"Error during indexing: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def hash_document_tree():
+    """Walk the document tree and hash each document's path, mtime and size"""
+    digest = hashlib.sha256()
+    for doc_path in sorted(walk_documents()):
+        try:
+            stat = doc_path.stat()
+        except FileNotFoundError:
+            # Deleted since the walk
+            continue
+        digest.update(f"{doc_path.relative_to(DOCUMENT_BASE_PATH)}\0{stat.st_mtime}\0{stat.st_size}\n".encode())
+    return digest
+
+@api_router.get("/files/index/fingerprint")
+async def get_index_fingerprint():
+    """Fingerprint the document tree and index state, changes whenever a re-index would"""
+    try:
+        digest = await asyncio.to_thread(hash_document_tree)
+        digest.update(f"indexed={await db.indexed_files.count_documents({})}".encode())
+        return {"fingerprint": digest.hexdigest()}
+        
+    except Exception as e:
+        logger.error(f"Error computing index fingerprint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/search")
 async def search_files(q: str, limit: int = 50):
     """Search files by name and content"""
@@ -311,43 +789,33 @@ async def search_files(q: str, limit: int = 50):
         results = []
         
         # Search by filename in all supported document types
-        for extension in SUPPORTED_EXTENSIONS:
-            for doc_path in DOCUMENT_BASE_PATH.rglob(f"*{extension}"):
-                if search_term in doc_path.name.lower():
-                    results.append(SearchResult(
-                        file_path=str(doc_path.relative_to(DOCUMENT_BASE_PATH)),
-                        file_name=doc_path.name,
-                        match_type="filename"
-                    ))
+        for relative_path, name in await find_documents_by_name(search_term):
+            results.append(SearchResult(
+                file_path=relative_path,
+                file_name=name,
+                match_type="filename"
+            ))
         
         # Search by content in indexed files
-        content_matches = await db.indexed_files.find({
-            "content": {"$regex": search_term, "$options": "i"}
-        }).to_list(limit)
+        content_matches = await find_content_matches(search_term, limit)
+        results_by_path = {r.file_path: r for r in results}
         
         for match in content_matches:
             # Extract snippet around match
-            content = match.get("content", "")
-            lower_content = content.lower()
-            match_index = lower_content.find(search_term)
+            snippet = build_snippet(match.get("content", ""), match.get("content_lower", ""), search_term)
             
-            if match_index >= 0:
-                start = max(0, match_index - 100)
-                end = min(len(content), match_index + 100)
-                snippet = content[start:end]
-                
-                # Check if already in results (from filename search)
-                existing = next((r for r in results if r.file_path == match["file_path"]), None)
-                if existing:
-                    existing.content_match = f"...{snippet}..."
-                    existing.match_type = "both"
-                else:
-                    results.append(SearchResult(
-                        file_path=match["file_path"],
-                        file_name=match["file_name"],
-                        content_match=f"...{snippet}...",
-                        match_type="content"
-                    ))
+            # Check if already in results (from filename search)
+            existing = results_by_path.get(match["file_path"])
+            if existing:
+                existing.content_match = f"...{snippet}..."
+                existing.match_type = "both"
+            else:
+                results.append(SearchResult(
+                    file_path=match["file_path"],
+                    file_name=match["file_name"],
+                    content_match=f"...{snippet}...",
+                    match_type="content"
+                ))
         
         # Limit results
         results = results[:limit]
@@ -376,6 +844,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_search_indexes():
+    try:
+        await ensure_search_indexes()
+    except Exception as e:
+        logger.error(f"Error creating search indexes: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
